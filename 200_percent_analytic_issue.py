@@ -3,43 +3,169 @@ SCRIPT TO FIX ISSUE AFTER UPGRADE, SOME analytic_distribution BY SOME REASON HAS
 
 To fix this issue we need to change the value but sql is not enough because some values need to be recomputed, because if you go to profit/loss the values could dismatch
 
+Detection works in id-range chunks (optionally in parallel workers) on the lines whose keys
+hold several accounts only, the affected lines are kept in fix_200_candidates and only them are
+backed up.
+
+The script can run in several time-boxed slices (e.g. a cron with TIME_LIMIT under its timeout):
+every committed batch records its moves in fix_200_progress, the next run only detects and
+processes the moves not recorded yet. Moves with failed lines are recorded as 'failed', delete
+their rows from fix_200_progress to retry them.
+
 OPW-5890817
 """
 
 from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+import json
 import logging
+import sys
+import time
+
+import odoo
+
+sys.path.insert(0, '<path to odoo_useful_scripts>')
+from progress_logger import ProgressLogger, ir_logging_sink
 
 _logger = logging.getLogger(__name__)
 
-msgs = []
+# Moves written (and committed) together, lines with the same new distribution
+# are written in one ORM call per batch
+BATCH_MOVES = 50
+
+# Lines scanned per detection chunk, and chunks scanned at the same time (own cursor each)
+DETECTION_CHUNK = 500000
+DETECTION_WORKERS = 1
+
+# Partial index on the multi-account lines, speeds up the detection of the next runs,
+# dropped once every move is processed
+CREATE_INDEX = False
+
+# Seconds after which no new batch is started (0: no limit), keep it under the cron timeout
+TIME_LIMIT = 0
+started_at = time.monotonic()
+
+# Full detail (one line per move), streamed as the script runs
+DETAIL_FILE = f'/tmp/fix_200_{env.cr.dbname}.log'
 
-def _log_msgs(msg, header=False):
-    msg = msg if not header else f"\n{header*10}\n{msg}\n{header*10}\n"
-    _logger.info(msg)
-    msgs.append(msg)
+# Summary to the logger and ir.logging (in chunks), every move in the detail file
+log = ProgressLogger(
+    logger=_logger,
+    detail_file=DETAIL_FILE,
+    summary_sink=ir_logging_sink(env, 'fix_200'),
+)
 
-def _progress_bar(current, total, bar_length=50):
-    """Generate a progress bar string"""
-    progress = float(current) / float(total)
-    arrow = '█' * int(round(progress * bar_length))
-    spaces = '░' * (bar_length - len(arrow))
-    percent = round(progress * 100, 2)
-    return f'[{arrow}{spaces}] {percent}% ({current}/{total})'
+# Cheap pre-filter: a duplicated account needs a key with several accounts, e.g. "285,285"
+MULTI_ACCOUNT_KEY = """analytic_distribution::text ~ '"[0-9]+,[0-9,]+"'"""
 
-# Backup
+# Exact check, only run on the pre-filtered lines
+DUPLICATED_ACCOUNT = """EXISTS (
+      SELECT 1
+      FROM jsonb_each_text(analytic_distribution)
+      WHERE array_length(string_to_array(key, ','), 1) !=
+            (SELECT count(DISTINCT x) FROM unnest(string_to_array(key, ',')) x)
+  )"""
+
+# Detection state, to resume after a timeout
 env.cr.execute("""
-CREATE TABLE IF NOT EXISTS account_move_line_analytic_backup AS 
-SELECT id, analytic_distribution, move_id, write_date
-FROM account_move_line 
-WHERE analytic_distribution IS NOT NULL;
+CREATE TABLE IF NOT EXISTS fix_200_candidates (
+    id INTEGER PRIMARY KEY,
+    move_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fix_200_detected_chunks (
+    chunk_start INTEGER PRIMARY KEY
+);
 """)
-_log_msgs("BACKUP CREATED!", "=")
+if CREATE_INDEX:
+    env.cr.execute(f"""
+    CREATE INDEX IF NOT EXISTS fix_200_multi_account_key_idx
+    ON account_move_line (id)
+    WHERE {MULTI_ACCOUNT_KEY}
+    """)
+    log.log("PARTIAL INDEX CREATED!", "=")
+env.cr.commit()
+
+def _detect_chunk(chunk_start):
+    """Store the affected lines of [chunk_start, chunk_start + DETECTION_CHUNK[ in fix_200_candidates"""
+    with odoo.sql_db.db_connect(env.cr.dbname).cursor() as cr:
+        cr.execute(f"""
+        INSERT INTO fix_200_candidates (id, move_id)
+        SELECT id, move_id
+        FROM account_move_line
+        WHERE id >= %s AND id < %s
+          AND analytic_distribution IS NOT NULL
+          AND parent_state = 'posted'
+          AND {MULTI_ACCOUNT_KEY}
+          AND {DUPLICATED_ACCOUNT}
+        ON CONFLICT (id) DO NOTHING
+        """, [chunk_start, chunk_start + DETECTION_CHUNK])
+        found = cr.rowcount
+        # Committed with the candidates of the chunk
+        cr.execute("INSERT INTO fix_200_detected_chunks VALUES (%s)", [chunk_start])
+        cr.commit()
+    return found
+
+env.cr.execute("SELECT min(id), max(id) FROM account_move_line")
+min_id, max_id = env.cr.fetchone()
+env.cr.execute("SELECT chunk_start FROM fix_200_detected_chunks")
+detected_chunks = {chunk_start for chunk_start, in env.cr.fetchall()}
+# Chunks are aligned on multiples of DETECTION_CHUNK, so they match between runs
+if any(chunk_start % DETECTION_CHUNK for chunk_start in detected_chunks):
+    raise ValueError("DETECTION_CHUNK changed since the last run, empty fix_200_detected_chunks first")
+chunks = [
+    chunk_start
+    for chunk_start in range((min_id or 0) // DETECTION_CHUNK * DETECTION_CHUNK, (max_id or -1) + 1, DETECTION_CHUNK)
+    if chunk_start not in detected_chunks
+]
+log.log(f"DETECTING DUPLICATED ACCOUNTS IN {len(chunks)} CHUNKS OF {DETECTION_CHUNK} IDS", "=")
+with ThreadPool(max(1, DETECTION_WORKERS)) as pool:
+    for done, found in enumerate(pool.imap_unordered(_detect_chunk, chunks), 1):
+        log.detail(f"DETECTION CHUNK {done}/{len(chunks)}: {found} LINES")
+        log.progress(done, len(chunks), "- DETECTION")
+
+# The workers committed on their own connections: end the transaction of env.cr (repeatable
+# read), otherwise the backup below still sees fix_200_candidates as it was before the detection
 env.cr.commit()
 
-# Get all lines to update grouped by move_id
+# Backup, only the affected lines
+env.cr.execute("""
+CREATE TABLE IF NOT EXISTS account_move_line_analytic_backup (
+    id INTEGER,
+    analytic_distribution JSONB,
+    move_id INTEGER,
+    write_date TIMESTAMP
+);
+INSERT INTO account_move_line_analytic_backup (id, analytic_distribution, move_id, write_date)
+SELECT aml.id, aml.analytic_distribution, aml.move_id, aml.write_date
+FROM fix_200_candidates c
+JOIN account_move_line aml ON aml.id = c.id
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM account_move_line_analytic_backup b
+    WHERE b.id = c.id
+);
+""")
+log.log(f"BACKUP CREATED! ({env.cr.rowcount} NEW LINES)", "=")
+
+# Progress, to resume after a timeout
 env.cr.execute("""
+CREATE TABLE IF NOT EXISTS fix_200_progress (
+    move_id INTEGER PRIMARY KEY,
+    status VARCHAR NOT NULL,
+    batch INTEGER NOT NULL,
+    write_date TIMESTAMP NOT NULL DEFAULT now()
+);
+""")
+env.cr.execute("SELECT count(*), coalesce(max(batch), 0) FROM fix_200_progress")
+already_processed, last_batch = env.cr.fetchone()
+if already_processed:
+    log.log(f"RESUMING AFTER BATCH {last_batch} ({already_processed} MOVES ALREADY PROCESSED)", "=")
+env.cr.commit()
+
+# Get the detected lines to update, re-checked on their current value
+env.cr.execute(f"""
 SELECT 
-    id,
+    aml.id,
     (
         SELECT jsonb_object_agg(
             array_to_string(
@@ -51,23 +177,24 @@ SELECT
             ),
             value
         )
-        FROM jsonb_each(analytic_distribution)
+        FROM jsonb_each(aml.analytic_distribution)
     ) as new_values,
-    move_id
-FROM account_move_line
-WHERE analytic_distribution IS NOT NULL 
-  AND parent_state = 'posted'
-  AND EXISTS (
-      SELECT 1 
-      FROM jsonb_each_text(analytic_distribution) 
-      WHERE array_length(string_to_array(key, ','), 1) != 
-            (SELECT count(DISTINCT x) FROM unnest(string_to_array(key, ',')) x)
+    aml.move_id
+FROM fix_200_candidates c
+JOIN account_move_line aml ON aml.id = c.id
+WHERE aml.analytic_distribution IS NOT NULL 
+  AND aml.parent_state = 'posted'
+  AND {DUPLICATED_ACCOUNT}
+  AND NOT EXISTS (
+      SELECT 1
+      FROM fix_200_progress p
+      WHERE p.move_id = aml.move_id
   )
-ORDER BY move_id;
+ORDER BY aml.move_id;
 """)
 
 results = env.cr.fetchall()
-_log_msgs(f"FOUND {len(results)} LINES TO UPDATE!", "=")
+log.log(f"FOUND {len(results)} LINES TO UPDATE!", "=")
 
 # Group by move_id
 lines_by_move = defaultdict(list)
@@ -75,110 +202,127 @@ for aml_id, new_dist, move_id in results:
     lines_by_move[move_id].append((aml_id, new_dist))
 
 total_moves = len(lines_by_move)
-_log_msgs(f"GROUPED INTO {total_moves} MOVES", "=")
+log.log(f"GROUPED INTO {total_moves} MOVES", "=")
 
 # Track results
-fixed_moves = []  # (move, lines_fixed, lines_total)
+fixed_moves_count = 0  # moves are listed in the detail file
 unfixed_moves = []  # (move, lines_failed, lines_total, errors)
 total_lines_fixed = 0
 total_lines_failed = 0
 processed_count = 0
 
-# Process by move
-for move_id, lines in lines_by_move.items():
-    processed_count += 1
-    move = env['account.move'].browse(move_id)
-    
-    # Progress bar
-    progress = _progress_bar(processed_count, total_moves)
-    _log_msgs(f"\n{progress}")
-    _log_msgs(f"PROCESSING MOVE: {move.name} (#{move_id}) - {len(lines)} lines", "-")
+def _write_lines(lines):
+    """Write lines [(aml_id, new_dist)] grouped by distribution, one flush at the end"""
+    lines_by_dist = defaultdict(list)
+    for aml_id, new_dist in lines:
+        lines_by_dist[json.dumps(new_dist, sort_keys=True)].append(aml_id)
+    for dist_key, aml_ids in lines_by_dist.items():
+        env['account.move.line'].browse(aml_ids).write({
+            'analytic_distribution': json.loads(dist_key)
+        })
+    env.flush_all()
+
+move_ids = list(lines_by_move)
+
+# Process by batch of moves
+for batch_start in range(0, total_moves, BATCH_MOVES):
+    if TIME_LIMIT and time.monotonic() - started_at > TIME_LIMIT:
+        log.log(f"TIME LIMIT REACHED, {total_moves - processed_count} MOVES LEFT FOR THE NEXT RUN", "!")
+        break
+    last_batch += 1
+    batch_move_ids = move_ids[batch_start:batch_start + BATCH_MOVES]
+    batch_lines = [line for move_id in batch_move_ids for line in lines_by_move[move_id]]
+    line_errors = {}  # aml_id: error
     
-    lines_fixed_in_move = 0
-    lines_failed_in_move = 0
-    move_errors = []
+    try:
+        with env.cr.savepoint():
+            _write_lines(batch_lines)
+    except Exception as e:
+        # Fallback: line by line, only for this batch
+        env.invalidate_all()
+        log.log(f"BATCH WRITE FAILED ({e}), RETRYING LINE BY LINE", "!")
+        for aml_id, new_dist in batch_lines:
+            try:
+                with env.cr.savepoint():
+                    _write_lines([(aml_id, new_dist)])
+            except Exception as line_error:
+                env.invalidate_all()
+                line_errors[aml_id] = str(line_error)
+                log.log(f"  ✗ ERROR updating line #{aml_id}: {line_error}", "!")
     
-    # Update all lines in the move
-    for aml_id, new_dist in lines:
-        try:
-            env['account.move.line'].browse(aml_id).write({
-                'analytic_distribution': new_dist
-            })
-            lines_fixed_in_move += 1
-            total_lines_fixed += 1
-            _log_msgs(f"  ✓ Updated line #{aml_id}")
-        except Exception as e:
-            error_msg = str(e)
-            lines_failed_in_move += 1
-            total_lines_failed += 1
-            move_errors.append(f"Line #{aml_id}: {error_msg}")
-            _log_msgs(f"  ✗ ERROR updating line #{aml_id}: {error_msg}", "!")
+    # Categorize moves of the batch
+    move_status = []
+    for move_id in batch_move_ids:
+        processed_count += 1
+        move = env['account.move'].browse(move_id)
+        lines = lines_by_move[move_id]
+        move_errors = [f"Line #{aml_id}: {line_errors[aml_id]}" for aml_id, _dist in lines if aml_id in line_errors]
+        lines_failed_in_move = len(move_errors)
+        lines_fixed_in_move = len(lines) - lines_failed_in_move
+        total_lines_fixed += lines_fixed_in_move
+        total_lines_failed += lines_failed_in_move
+        
+        if lines_failed_in_move == 0:
+            # All lines fixed
+            fixed_moves_count += 1
+            move_status.append('fixed')
+            log.detail(f"  ✓ MOVE FULLY FIXED: {move.name} (#{move_id}) {lines_fixed_in_move}/{len(lines)} lines")
+        else:
+            # Some or all lines failed
+            unfixed_moves.append((move, lines_failed_in_move, len(lines), move_errors))
+            move_status.append('failed')
+            log.detail(f"  ⚠ MOVE PARTIALLY/NOT FIXED: {move.name} (#{move_id}) {lines_fixed_in_move}/{len(lines)} lines fixed, {lines_failed_in_move} failed")
     
-    # Categorize move
-    if lines_failed_in_move == 0:
-        # All lines fixed
-        fixed_moves.append((move, lines_fixed_in_move, len(lines)))
-        _log_msgs(f"  ✓ MOVE FULLY FIXED: {lines_fixed_in_move}/{len(lines)} lines")
-    else:
-        # Some or all lines failed
-        unfixed_moves.append((move, lines_failed_in_move, len(lines), move_errors))
-        _log_msgs(f"  ⚠ MOVE PARTIALLY/NOT FIXED: {lines_fixed_in_move}/{len(lines)} lines fixed, {lines_failed_in_move} failed")
+    # Recorded in the same transaction as the writes
+    env.cr.execute("""
+    INSERT INTO fix_200_progress (move_id, status, batch)
+    SELECT unnest(%s::int[]), unnest(%s::varchar[]), %s
+    ON CONFLICT (move_id) DO NOTHING
+    """, [batch_move_ids, move_status, last_batch])
     
-    # Commit every N moves to avoid very long transactions
-    if processed_count % 10 == 0:
-        env.cr.commit()
-        _log_msgs(f"BATCH COMMITTED ({processed_count}/{total_moves} moves processed)", "$")
+    # Commit every batch to avoid very long transactions
+    env.cr.commit()
+    log.detail(f"BATCH {last_batch} COMMITTED ({processed_count}/{total_moves} moves processed)")
+    log.progress(processed_count, total_moves, f"- BATCH {last_batch} COMMITTED")
 
 # Final commit
 env.cr.commit()
 
 # Final summary
-_log_msgs(f"\n{_progress_bar(total_moves, total_moves)}", "=")
-_log_msgs(f"\nPROCESSING COMPLETE!", "=")
-_log_msgs(f"TOTAL LINES FIXED: {total_lines_fixed}", "=")
-_log_msgs(f"TOTAL LINES FAILED: {total_lines_failed}", "=")
-_log_msgs(f"TOTAL MOVES PROCESSED: {total_moves}", "=")
+log.progress(processed_count, total_moves)
+if processed_count == total_moves:
+    env.cr.execute("DROP INDEX IF EXISTS fix_200_multi_account_key_idx")
+    log.log(f"\nPROCESSING COMPLETE!", "=")
+else:
+    log.log(f"\nPROCESSING PAUSED, RUN IT AGAIN TO CONTINUE!", "=")
+log.log(f"TOTAL LINES FIXED: {total_lines_fixed}", "=")
+log.log(f"TOTAL LINES FAILED: {total_lines_failed}", "=")
+log.log(f"TOTAL MOVES PROCESSED: {processed_count}/{total_moves}", "=")
 
 # Fixed moves summary
-_log_msgs(f"\n✓ FIXED MOVES ({len(fixed_moves)}):", "@")
-if fixed_moves:
-    fixed_summary = '\n'.join([
-        f'  - {m.name} (#{m.id}) - {lines_fixed}/{lines_total} lines' 
-        for m, lines_fixed, lines_total in fixed_moves
-    ])
-    _log_msgs(fixed_summary)
-else:
-    _log_msgs("  (none)")
+log.log(f"\n✓ FIXED MOVES ({fixed_moves_count}): listed in {DETAIL_FILE}", "@")
 
 # Unfixed moves summary
-_log_msgs(f"\n⚠ UNFIXED/PARTIALLY FIXED MOVES ({len(unfixed_moves)}):", "@")
+log.log(f"\n⚠ UNFIXED/PARTIALLY FIXED MOVES ({len(unfixed_moves)}):", "@")
 if unfixed_moves:
     unfixed_summary = '\n'.join([
         f'  - {m.name} (#{m.id}) - {lines_failed}/{lines_total} lines failed\n    Errors: {"; ".join(errors[:3])}{"..." if len(errors) > 3 else ""}' 
         for m, lines_failed, lines_total, errors in unfixed_moves
     ])
-    _log_msgs(unfixed_summary)
+    log.log(unfixed_summary)
 else:
-    _log_msgs("  (none)")
+    log.log("  (none)")
 
 # Statistics
 success_rate = round((total_lines_fixed / (total_lines_fixed + total_lines_failed) * 100), 2) if (total_lines_fixed + total_lines_failed) > 0 else 0
-move_success_rate = round((len(fixed_moves) / total_moves * 100), 2) if total_moves > 0 else 0
-
-_log_msgs(f"\nSTATISTICS:", "=")
-_log_msgs(f"Line Success Rate: {success_rate}%")
-_log_msgs(f"Move Success Rate: {move_success_rate}%")
-_log_msgs(f"Fully Fixed Moves: {len(fixed_moves)}/{total_moves}")
-_log_msgs(f"Unfixed/Partial Moves: {len(unfixed_moves)}/{total_moves}")
-
-# Final log
-env['ir.logging'].create({
-    'name': 'fix_200',
-    'type': 'server',
-    'level': 'INFO',
-    'dbname': env.cr.dbname,
-    'message': '\n'.join(msgs),
-    'func': '',
-    'path': '',
-    'line': '',
-})
+move_success_rate = round((fixed_moves_count / processed_count * 100), 2) if processed_count > 0 else 0
+
+log.log(f"\nSTATISTICS:", "=")
+log.log(f"Line Success Rate: {success_rate}%")
+log.log(f"Move Success Rate: {move_success_rate}%")
+log.log(f"Fully Fixed Moves: {fixed_moves_count}/{processed_count}")
+log.log(f"Unfixed/Partial Moves: {len(unfixed_moves)}/{processed_count}")
+
+# Last summary chunk
+log.close()
+env.cr.commit()
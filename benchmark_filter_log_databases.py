@@ -0,0 +1,215 @@
+"""
+Benchmark for filter_log_databases.py.
+
+Runs the list, filter and split paths of every engine against a log fixture
+and reports MB/s, lines/s and peak RSS. Each case runs in its own process,
+so the peak memory of one case never hides the one of the next.
+
+Generate the fixtures once with generate_odoo_log.py (or --generate):
+  python generate_odoo_log.py -o bench_1g.log -s 1G --seed 42
+  python generate_odoo_log.py -o bench_10g.log -s 10G --seed 42
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import filter_log_databases as fld
+from generate_odoo_log import generate_log, parse_size
+
+CASES = [
+    'list',
+    'filter-stream',
+    'filter-mmap',
+    'filter-jobs',
+    'filter-index-cold',
+    'filter-index-warm',
+    'filter-window',
+    'split',
+    'report',
+]
+
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process and its finished children (--jobs workers).
+    """
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def count_lines(input_file):
+    lines = 0
+    with open(input_file, 'rb') as f:
+        while True:
+            block = f.read(fld.READ_BLOCK_SIZE)
+            if not block:
+                return lines
+            lines += block.count(b'\n')
+
+
+def pick_database(input_file):
+    """
+    The first database of the log, so the filter has something to write.
+    """
+    with open(input_file, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            db_name = fld.extract_database_name(line)
+            if db_name:
+                return db_name
+    return None
+
+
+def run_case(case, input_file, work_dir, database, jobs):
+    """
+    Run a single case in the current process. Returns the elapsed seconds.
+    """
+    output_file = os.path.join(work_dir, 'output.log')
+    index_path = fld.get_index_path(input_file)
+
+    if case == 'filter-index-cold':
+        index_path.unlink(missing_ok=True)
+    elif case == 'filter-index-warm':
+        fld.load_log_index(input_file)
+
+    start = time.perf_counter()
+
+    if case == 'list':
+        fld.get_available_databases(input_file)
+    elif case == 'filter-stream':
+        fld.filter_logs_by_database(input_file, output_file, database)
+    elif case == 'filter-mmap':
+        fld.filter_logs_mmap(input_file, output_file, database)
+    elif case == 'filter-jobs':
+        fld.filter_logs_parallel(input_file, output_file, database, jobs)
+    elif case in ('filter-index-cold', 'filter-index-warm'):
+        fld.filter_logs_with_index(input_file, output_file, database)
+    elif case == 'filter-window':
+        # Ten minutes, one hour after the start of the log
+        with open(input_file, 'rb') as f:
+            first = fld.search_log_entry(f.read(64 * 1024))
+        moment = datetime.fromisoformat(fld._entry_timestamp(first).decode().replace(',', '.'))
+        since = fld.parse_log_time(str(moment + timedelta(hours=1)))
+        until = fld.parse_log_time(str(moment + timedelta(hours=1, minutes=10)))
+        fld.filter_logs_mmap(input_file, output_file, None, since=since, until=until)
+    elif case == 'split':
+        fld.split_logs_by_database(input_file, os.path.join(work_dir, 'split'))
+    elif case == 'report':
+        fld.report_tracebacks(input_file, output_file)
+
+    elapsed = time.perf_counter() - start
+
+    if case.startswith('filter-index'):
+        index_path.unlink(missing_ok=True)
+    return elapsed
+
+
+def run_isolated(case, input_file, database, jobs):
+    """
+    Run a case in a child process and collect its measures.
+    """
+    work_dir = tempfile.mkdtemp(prefix='bench_fld_')
+    try:
+        output = subprocess.run(
+            [
+                sys.executable, __file__, '--run-case', case,
+                '-i', input_file, '-d', database, '-j', str(jobs), '--work-dir', work_dir,
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark filter_log_databases.py engines',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s -i bench_1g.log
+  %(prog)s -i bench_10g.log --cases filter-stream filter-mmap filter-jobs -j 8
+  %(prog)s -i bench_1g.log --generate 1G
+        """
+    )
+
+    parser.add_argument('-i', '--input',
+                        required=True,
+                        help='Log fixture to benchmark')
+
+    parser.add_argument('-d', '--database',
+                        help='Database used by the filter cases (default: the first one in the log)')
+
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='Processes used by filter-jobs (default: CPU count)')
+
+    parser.add_argument('--cases',
+                        nargs='+',
+                        choices=CASES,
+                        default=CASES,
+                        help='Cases to run (default: all)')
+
+    parser.add_argument('--generate',
+                        type=parse_size,
+                        help='Generate the fixture with this size first, e.g. 1G')
+
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    # Child process: run one case and print its measures
+    if args.run_case:
+        elapsed = run_case(args.run_case, args.input, args.work_dir, args.database, args.jobs)
+        print(json.dumps({'elapsed': elapsed, 'peak_rss_mb': peak_rss_mb()}))
+        return
+
+    if args.generate:
+        print(f"Generating {args.generate} bytes of log in: {args.input}")
+        generate_log(args.input, args.generate, seed=42)
+
+    if not Path(args.input).exists():
+        print(f"Error: Input file '{args.input}' does not exist.")
+        sys.exit(1)
+
+    size_mb = Path(args.input).stat().st_size / (1024 * 1024)
+    lines = count_lines(args.input)
+    database = args.database or pick_database(args.input)
+
+    print(f"Input:    {args.input} ({size_mb:.1f} MB, {lines} lines)")
+    print(f"Database: {database}")
+    print(f"Jobs:     {args.jobs}\n")
+    print(f"{'case':<20}{'seconds':>10}{'MB/s':>10}{'lines/s':>14}{'peak RSS MB':>14}")
+
+    for case in args.cases:
+        result = run_isolated(case, args.input, database, args.jobs)
+        elapsed = max(result['elapsed'], 1e-9)
+        print(
+            f"{case:<20}{elapsed:>10.2f}{size_mb / elapsed:>10.1f}"
+            f"{lines / elapsed:>14.0f}{result['peak_rss_mb']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\nProcess cancelled by user.")
+        sys.exit(0)
@@ -2,6 +2,11 @@
 COMPARE MISSING CONSTRAINTS
 
 Script helpful to identify which constraints are missing, it compares a clean database vs a old one.
+Indexes and triggers are compared too, by definition, so objects that exist but differ are reported.
+A DDL script to create the missing objects is generated (indexes are built CONCURRENTLY).
+
+The clean side can be a snapshot file (--dump) instead of a live database, so a reference
+snapshot per Odoo version can be kept and reused without restoring a clean database each time.
 
 Important: Both dbs should have the same apps installed.
 
@@ -10,11 +15,27 @@ Created by: vmac-odoo
 """
 
 import psycopg2
+import argparse
 import csv
+import gzip
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+# Objects compared, in the order the fix DDL creates them
+OBJECT_TYPES = ['index', 'constraint', 'trigger']
+PLURALS = {'index': 'indexes', 'constraint': 'constraints', 'trigger': 'triggers'}
+# Catalog snapshots are gzipped JSON files
+SNAPSHOT_SUFFIX = '.json.gz'
+# Catalogs fetched at the same time, i.e. open connections on the server
+MAX_CONNECTIONS = 4
 
 
 class Database:
     def __init__(self, dbname):
+        self.name = dbname
         self.conn = psycopg2.connect(
             dbname=dbname,
             user='<user>',
@@ -27,42 +48,216 @@ class Database:
         self.cr.close()
         self.conn.close()
     
-    def get_all_tables(self):
+    def get_catalog(self):
+        """
+        Fetch every public table with its constraints, indexes and triggers,
+        one bulk query per kind of object.
+        Returns a dict:
+        - tables: set of table names
+        - constraint/index/trigger: {(table, name): definition}
+        Indexes created by a primary key, unique or exclusion constraint are
+        left out, they come with their constraint.
+        """
+        # Tables without constraints come back with a NULL conname
         self.cr.execute("""
-            SELECT table_name
-            FROM information_schema.tables
-            WHERE table_schema = 'public'
-            AND table_type = 'BASE TABLE';
+            SELECT pg_class.relname, pg_constraint.conname, pg_get_constraintdef(pg_constraint.oid)
+            FROM pg_class
+            JOIN pg_namespace ON pg_class.relnamespace = pg_namespace.oid
+            LEFT JOIN pg_constraint ON pg_constraint.conrelid = pg_class.oid
+            WHERE pg_namespace.nspname = 'public'
+            AND pg_class.relkind IN ('r', 'p');
         """)
-        return set(table for table, in self.cr.fetchall())
-    
-    def get_table_constraints(self, table):
+        catalog = {'tables': set(), 'constraint': {}, 'index': {}, 'trigger': {}}
+        for table, constraint, definition in self.cr.fetchall():
+            catalog['tables'].add(table)
+            if constraint:
+                catalog['constraint'][(table, constraint)] = definition
+        
         self.cr.execute("""
-            SELECT conname
-            FROM pg_constraint
-            JOIN pg_class ON pg_constraint.conrelid = pg_class.oid
-            WHERE pg_class.relname = %s;
-        """, [table])
-        return set(constraint for constraint, in self.cr.fetchall())
+            SELECT tbl.relname, idx.relname, pg_get_indexdef(idx.oid)
+            FROM pg_index
+            JOIN pg_class idx ON pg_index.indexrelid = idx.oid
+            JOIN pg_class tbl ON pg_index.indrelid = tbl.oid
+            JOIN pg_namespace ON tbl.relnamespace = pg_namespace.oid
+            WHERE pg_namespace.nspname = 'public'
+            AND NOT EXISTS (
+                SELECT 1
+                FROM pg_constraint
+                WHERE pg_constraint.conindid = pg_index.indexrelid
+                AND pg_constraint.conrelid = pg_index.indrelid
+                AND pg_constraint.contype IN ('p', 'u', 'x')
+            );
+        """)
+        catalog['index'] = {(table, index): definition for table, index, definition in self.cr.fetchall()}
+        
+        self.cr.execute("""
+            SELECT pg_class.relname, pg_trigger.tgname, pg_get_triggerdef(pg_trigger.oid)
+            FROM pg_trigger
+            JOIN pg_class ON pg_trigger.tgrelid = pg_class.oid
+            JOIN pg_namespace ON pg_class.relnamespace = pg_namespace.oid
+            WHERE pg_namespace.nspname = 'public'
+            AND NOT pg_trigger.tgisinternal;
+        """)
+        catalog['trigger'] = {(table, trigger): definition for table, trigger, definition in self.cr.fetchall()}
+        return catalog
+    
+    def dump_snapshot(self, path):
+        """
+        Save the catalog to a snapshot file, to compare against it later
+        without this database.
+        """
+        catalog = self.get_catalog()
+        self.cr.execute("SHOW server_version;")
+        snapshot = {
+            'database': self.name,
+            'server_version': self.cr.fetchone()[0],
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'tables': sorted(catalog['tables']),
+            **{
+                object_type: sorted([table, name, definition] for (table, name), definition in catalog[object_type].items())
+                for object_type in OBJECT_TYPES
+            },
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        print(f'SNAPSHOT SAVED AT: {path}')
+
+
+class Snapshot:
+    """
+    Catalog saved by Database.dump_snapshot(), usable wherever a Database is.
+    """
+    def __init__(self, path):
+        self.name = path
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            self.snapshot = json.load(f)
+    
+    def kill(self):
+        pass
+    
+    def get_catalog(self):
+        catalog = {'tables': set(self.snapshot['tables'])}
+        for object_type in OBJECT_TYPES:
+            catalog[object_type] = {
+                (table, name): definition
+                for table, name, definition in self.snapshot.get(object_type, [])
+            }
+        return catalog
+
+
+def open_catalog(source):
+    """
+    A snapshot file path gives a Snapshot, anything else is a database name.
+    """
+    if source.endswith(SNAPSHOT_SUFFIX) and Path(source).exists():
+        return Snapshot(source)
+    return Database(source)
+
+
+def fetch_catalog(source):
+    """
+    Open the source, read its catalog and close it right away, so the
+    connection is only held while its queries run.
+    """
+    catalog_source = open_catalog(source)
+    try:
+        return catalog_source.get_catalog()
+    finally:
+        catalog_source.kill()
+
+
+def fetch_catalogs(sources, max_connections=MAX_CONNECTIONS):
+    """
+    Fetch the catalogs of several sources concurrently, at most
+    max_connections at a time (psycopg2 releases the GIL while waiting).
+    Returns {source: catalog or exception}.
+    """
+    catalogs = {}
+    with ThreadPoolExecutor(max_workers=max_connections) as executor:
+        futures = {executor.submit(fetch_catalog, source): source for source in set(sources)}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                catalogs[source] = future.result()
+                print(f'CATALOG FETCHED: {source}')
+            except Exception as e:
+                catalogs[source] = e
+                print(f'ERROR FETCHING CATALOG OF {source}: {e}')
+    return catalogs
         
+
+def diff_catalogs(clean_catalog, old_catalog):
+    """
+    Compare the objects of the tables both databases have.
+    Returns a list of dicts (type, table, name, status, clean_definition, old_definition)
+    where status is 'missing' (only in clean) or 'different' (other definition in old).
+    """
+    tables_to_check = clean_catalog['tables'] & old_catalog['tables']
+    differences = []
+    for object_type in OBJECT_TYPES:
+        clean_objects = clean_catalog[object_type]
+        old_objects = old_catalog[object_type]
+        for table, name in sorted(clean_objects):
+            if table not in tables_to_check:
+                continue
+            clean_definition = clean_objects[(table, name)]
+            old_definition = old_objects.get((table, name))
+            if old_definition == clean_definition:
+                continue
+            differences.append({
+                'type': object_type,
+                'table': table,
+                'name': name,
+                'status': 'missing' if old_definition is None else 'different',
+                'clean_definition': clean_definition,
+                'old_definition': old_definition,
+            })
+    return differences
+
+
+def quote_ident(name):
+    return '"%s"' % name.replace('"', '""')
+
+
 class Report:
     
     general_report_sheet = '/<dir>/general_report_sheet.csv'
     full_report_sheet = '/<dir>/full_report_sheet.csv'
+    fix_ddl_script = '/<dir>/fix_ddl_script.sql'
     
-    def __init__(self, data):
+    def __init__(self, data, target=None):
         self.results = data
+        if target:
+            # One set of files per audited database
+            suffix = '_' + re.sub(r'[^\w.-]', '_', Path(target).name.replace(SNAPSHOT_SUFFIX, ''))
+            for attr in ('general_report_sheet', 'full_report_sheet', 'fix_ddl_script'):
+                path = Path(getattr(self, attr))
+                setattr(self, attr, str(path.with_name(f'{path.stem}{suffix}{path.suffix}')))
+            print(f'\n***** {target} *****')
         self.generate_general_info()
         self.generate_full_report()
+        self.generate_fix_ddl()
+    
+    @classmethod
+    def compare(cls, clean, old, target=None):
+        """
+        Diff two catalog sources (Database or Snapshot) and build the report.
+        """
+        return cls(diff_catalogs(clean.get_catalog(), old.get_catalog()), target)
         
     def generate_general_info(self):
-        columns = ['table', 'missing constraints (count)']
+        columns = ['table'] + [
+            f'{status} {PLURALS[object_type]} (count)'
+            for object_type in OBJECT_TYPES
+            for status in ('missing', 'different')
+        ]
+        counts = {}
+        for row in self.results:
+            table_counts = counts.setdefault(row['table'], dict.fromkeys(columns[1:], 0))
+            table_counts[f"{row['status']} {PLURALS[row['type']]} (count)"] += 1
         general_data = [
-            {
-                'table': table,
-                'missing constraints (count)': len(constraints)
-            }
-            for table, constraints in self.results.items()
+            {'table': table, **table_counts}
+            for table, table_counts in sorted(counts.items())
         ]
         with open(self.general_report_sheet, 'w',  newline='') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=columns)
@@ -75,40 +270,112 @@ class Report:
         print('##########################################')
         print('##########   GENERAL REPORT    ###########')
         print('##########################################')
-        report_str = [f"- TABLE: {gen_data['table']} - HAS {gen_data['missing constraints (count)']} MISSING CONSTRAINTS!" for gen_data in general_data]
+        report_str = [
+            f"- TABLE: {gen_data['table']} - HAS " + ', '.join(
+                f"{count} {column.replace(' (count)', '').upper()}"
+                for column, count in gen_data.items()
+                if column != 'table' and count
+            ) + '!'
+            for gen_data in general_data
+        ]
         print('\n'.join(report_str))
     
     def generate_full_report(self):
-        columns = ['constraint', 'table']
-        full_report = [
-            {
-                'constraint': constraint,
-                'table': table
-            }
-            for table, constraints in self.results.items()
-            for constraint in constraints
-        ]
+        columns = ['type', 'table', 'name', 'status', 'clean_definition', 'old_definition']
         with open(self.full_report_sheet, 'w',  newline='') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=columns)
             writer.writeheader()
-            writer.writerows(full_report)
+            writer.writerows(self.results)
             print(f'REPORT SAVED AT: {self.full_report_sheet}')
+    
+    def get_fix_statement(self, row):
+        table, name, definition = quote_ident(row['table']), quote_ident(row['name']), row['clean_definition']
+        if row['type'] == 'index':
+            # CONCURRENTLY: no write lock on the table while it is built
+            return re.sub(
+                r'^CREATE (UNIQUE )?INDEX ',
+                r'CREATE \1INDEX CONCURRENTLY IF NOT EXISTS ',
+                definition,
+            ) + ';'
+        if row['type'] == 'constraint':
+            return f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition};'
+        return f'{definition};'
+    
+    def get_drop_statement(self, row):
+        table, name = quote_ident(row['table']), quote_ident(row['name'])
+        if row['type'] == 'index':
+            return f'DROP INDEX CONCURRENTLY IF EXISTS {name};'
+        if row['type'] == 'constraint':
+            return f'ALTER TABLE {table} DROP CONSTRAINT {name};'
+        return f'DROP TRIGGER {name} ON {table};'
+    
+    def generate_fix_ddl(self):
+        lines = [
+            '-- Generated by compare_missing_constraints.py',
+            '-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block,',
+            '-- run this file with autocommit (e.g. plain psql -f, without -1).',
+        ]
+        for object_type in OBJECT_TYPES:
+            rows = [row for row in self.results if row['type'] == object_type]
+            missing = [row for row in rows if row['status'] == 'missing']
+            different = [row for row in rows if row['status'] == 'different']
+            if missing:
+                lines.append(f'\n-- MISSING {PLURALS[object_type].upper()} ({len(missing)})')
+                lines.extend(self.get_fix_statement(row) for row in missing)
+            if different:
+                # Never applied blindly, the old definition may be on purpose
+                lines.append(f'\n-- DIFFERENT {PLURALS[object_type].upper()} ({len(different)}), review before uncommenting')
+                for row in different:
+                    lines.append(f"-- old:   {row['old_definition']}")
+                    lines.append(f"-- {self.get_drop_statement(row)}")
+                    lines.append(f"-- {self.get_fix_statement(row)}")
+        with open(self.fix_ddl_script, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+            print(f'FIX DDL SAVED AT: {self.fix_ddl_script}')
         
-clean = Database('<clean-db-name>')
-old = Database('<old-db-name>')
-
-c_tables = clean.get_all_tables()
-o_tables = old.get_all_tables()
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the constraints, indexes and triggers of a clean database vs an old one',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+Databases and snapshot files ({SNAPSHOT_SUFFIX}) can be mixed.
 
-tables_to_check = o_tables & c_tables
-results = {}
-
-for table in tables_to_check:
-    missing_constraints = clean.get_table_constraints(table) - old.get_table_constraints(table)
-    if missing_constraints:
-        results[table] = missing_constraints
+Examples:
+  %(prog)s --clean clean_17 --old customer_db
+  %(prog)s --dump clean_17 /<dir>/clean_17{SNAPSHOT_SUFFIX}
+  %(prog)s --clean /<dir>/clean_17{SNAPSHOT_SUFFIX} --old customer_db
+  %(prog)s --clean /<dir>/clean_17{SNAPSHOT_SUFFIX} --old tenant1 tenant2 tenant3 --max-connections 2
+        """
+    )
+    parser.add_argument('--clean', help='Clean database name or snapshot file')
+    parser.add_argument('--old', nargs='+', help='Old database name(s) or snapshot file(s)')
+    parser.add_argument('--dump', nargs=2, metavar=('DATABASE', 'FILE'),
+                        help='Save the catalog of DATABASE to a snapshot FILE and exit')
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS,
+                        help=f'Catalogs fetched at the same time (default: {MAX_CONNECTIONS})')
+    args = parser.parse_args()
+    
+    if args.dump:
+        db = Database(args.dump[0])
+        db.dump_snapshot(args.dump[1])
+        db.kill()
+        return
+    
+    if not args.clean or not args.old:
+        parser.error('--clean and --old are required')
     
-Report(results)
+    catalogs = fetch_catalogs([args.clean, *args.old], args.max_connections)
+    clean_catalog = catalogs[args.clean]
+    if isinstance(clean_catalog, Exception):
+        raise clean_catalog
     
-clean.kill()
-old.kill()
\ No newline at end of file
+    # Files are suffixed with the target only when several are audited
+    several = len(args.old) > 1
+    for old in args.old:
+        if isinstance(catalogs[old], Exception):
+            continue
+        Report(diff_catalogs(clean_catalog, catalogs[old]), old if several else None)
+
+
+if __name__ == "__main__":
+    main()
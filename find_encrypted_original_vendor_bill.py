@@ -11,8 +11,13 @@ OPW-5900263
 '''
 
 
+import sys
+
 from PyPDF2 import PdfFileReader
 
+sys.path.insert(0, '<path to odoo_useful_scripts>')
+from progress_logger import ProgressLogger
+
 def review_encrypted_vendor_bills(account_moves=[]):
     report_xml = 'account.action_account_original_vendor_bill'
     report_model = env['ir.actions.report']
@@ -20,6 +25,7 @@ def review_encrypted_vendor_bills(account_moves=[]):
     encrypted_moves = []
     problematic_moves = []
     total = len(account_moves)
+    progress = ProgressLogger(total)
 
     print("="*60)
     print("PDF ENCRYPTION/MERGE ISSUE DETECTION")
@@ -27,9 +33,8 @@ def review_encrypted_vendor_bills(account_moves=[]):
     print("")
 
     for idx, move_id in enumerate(account_moves, 1):
-        # Progress loader
-        percentage = (idx / total) * 100
-        print(f"Progress: {idx}/{total} ({percentage:.1f}%) - Processing move #{move_id}")
+        # Progress loader, at most every few seconds
+        progress.progress(idx, msg=f"- Processing move #{move_id}")
         
         try:
             # Generate individual PDF
@@ -47,21 +52,21 @@ def review_encrypted_vendor_bills(account_moves=[]):
                         # Check if encrypted
                         if pdf_reader.isEncrypted:
                             encrypted_moves.append(move_id)
-                            print(f"  ⚠️  ENCRYPTED PDF DETECTED!")
+                            progress.log(f"  ⚠️  ENCRYPTED PDF DETECTED! (move #{move_id})")
                             break
                             
                     except Exception as e:
-                        print(e)
+                        progress.log(f"  Move #{move_id}: {e}")
                         if 'AES' in str(e) or 'PyCryptodome' in str(e) or 'encrypt' in str(e).lower():
                             encrypted_moves.append(move_id)
-                            print(f"  ⚠️  AES ENCRYPTION ERROR DETECTED!")
+                            progress.log(f"  ⚠️  AES ENCRYPTION ERROR DETECTED! (move #{move_id})")
                             break
                     finally:
                         stream.close()
                         
         except Exception as e:
             problematic_moves.append((move_id, str(e)[:100]))
-            print(f"  ❌ ERROR: {str(e)[:80]}")
+            progress.log(f"  ❌ ERROR (move #{move_id}): {str(e)[:80]}")
 
     print("")
     print("="*60)
@@ -15,10 +15,26 @@ Params:
 - generate_sql_and_csv: if true, will generate a full csv report with the modified records and some information, 
 and the most important: A SQL file, very helpful because in SAAS databases you cannot use this script, but you can 
 download the database locally, run this script, get the sql file and execute the queries in a scheduled action.
+The (id, res_model, res_id) travel as compact array literals loaded into a temp table, followed by a single
+UPDATE/DELETE of the attachments still linked to the same record.
+Both files are written to disk batch by batch.
 - print_data: if true, will show very simple report at the console.
 - strategy: To fix this, there are two ways to fix it
     1. update: that means that will set null the res_model, res_id and res_field. The attachment will be a fully orphan
     2. delete: that means that you dont need this attachments and they can go to the trash! [NO ROLLBACK]
+- fetch_size: orphan attachment ids fetched per round trip from the server-side cursor.
+- batch_size: attachments updated/deleted per statement, every batch is committed and saved in a
+checkpoint table (fix_orphan_attachments_checkpoint), if the run is interrupted the next one resumes
+after the last committed batch. The time of every batch is printed to tune this value under live traffic.
+- reconcile_filestore: if true, after the fix the filestore is compared with ir_attachment.store_fname
+(useful after strategy delete, the rows are gone but the files stay), orphan files and their sizes are
+written to orphan_files.csv. Both sides are walked sorted, so memory stays bounded with millions of files.
+- reconcile_only: if true, only the filestore reconciliation runs (orphan_files.csv, and the removal with
+remove_orphan_files), ir_attachment is neither searched nor modified.
+- remove_orphan_files: if true (with reconcile_filestore or reconcile_only), the orphan files are also removed from disk. [NO ROLLBACK]
+Files of a transaction not committed yet look orphan too, run it when nobody else is uploading files.
+- dry_run: if true, nothing is modified: per model it prints the orphan count, their total file_size and the
+rows/pages the fix would touch (from EXPLAIN and the catalog), to size the maintenance window.
 
 [USE IT BY YOUR OWN RISK!]
 
@@ -27,94 +43,298 @@ Created by: vmac-odoo
 """
 
 import csv
-from itertools import groupby
+import os
+import time
 from psycopg2 import sql
+from odoo.tools import config
 
 
 class FixOrphanAttachments:
     
-    def __init__(self, generate_sql_and_csv=False, print_data=True, strategy='update',):
+    checkpoint_table = 'fix_orphan_attachments_checkpoint'
+    sql_temp_table = 'fix_orphan_attachment_ids'
+    
+    def __init__(self, generate_sql_and_csv=False, print_data=True, strategy='update', fetch_size=10000, batch_size=1000,
+                 reconcile_filestore=False, remove_orphan_files=False, dry_run=False, reconcile_only=False,):
         self.dir = '/Users/nefonfo/Desktop/report_fix'
+        self.dry_run=dry_run
+        self.reconcile_filestore=reconcile_filestore
+        self.reconcile_only=reconcile_only
+        self.remove_orphan_files=remove_orphan_files
+        self.fetch_size=fetch_size
+        self.batch_size=batch_size
         self.generate_sql_and_csv=generate_sql_and_csv
-        self.sql = []
+        self.sql_file = None
+        self.csv_file = None
+        self.csv_writer = None
         self.print_data=print_data
         self.strategy=strategy
      
     def search_attachments(self):
         env.cr.execute(
             """
-            SELECT
-                res_model,
-                res_id
+            SELECT DISTINCT res_model
             FROM ir_attachment
             WHERE
                 type = 'binary'
                 AND res_id > 0
                 AND res_model IS NOT NULL
-            GROUP BY
-                res_model,
-                res_id
+            ORDER BY res_model
             """
         )
-        results = env.cr.fetchall()
-        results.sort(key=lambda x: x[0])
-        return results
+        return [res_model for res_model, in env.cr.fetchall()]
+    
+    def orphan_attachments_query(self, select, table):
+        """
+        Anti-join selecting the attachments of a model whose record does not exist anymore.
+        """
+        return sql.SQL(
+            """
+            SELECT {}
+                FROM ir_attachment a
+            WHERE
+                a.type = 'binary'
+                AND a.res_model = %s
+                AND a.res_id > 0
+                AND NOT EXISTS (
+                    SELECT 1 FROM {} r WHERE r.id = a.res_id
+                )
+            """
+        ).format(
+            sql.SQL(select),
+            sql.Identifier(table)
+        )
+    
+    def get_attachments_with_phantom_records(self, res_models):
+        """
+        Orphans are found by PostgreSQL itself with an anti-join per model, only their count
+        comes back: {res_model: orphan_count} of the models having orphans.
+        The ids are streamed later by iter_orphan_attachment_ids.
+        """
+        orphan_counts = {}
+        for res_model in res_models:
+            env.cr.execute(
+                self.orphan_attachments_query('count(*)', res_model.replace('.', '_')),
+                [res_model]
+            )
+            orphan_count = env.cr.fetchone()[0]
+            if orphan_count:
+                orphan_counts[res_model] = orphan_count
+        return orphan_counts
     
-    def get_attachments_with_phantom_records(self, ordered_attachments):
-        records_to_delete = {}
-        for res_model, attachments in groupby(ordered_attachments, key=lambda k: k[0]):
+    def iter_orphan_attachment_ids(self, res_model, after_id=0):
+        """
+        Yield the orphan attachment ids of a model after after_id, sorted, in tuples of batch_size.
+        Only one batch is held in memory at a time.
+        """
+        table = res_model.replace('.', '_')
+        # named cursor: server-side, rows are fetched by chunks of itersize,
+        # WITH HOLD so it survives the commit of every batch
+        with env.cr._cnx.cursor(name='orphan_attachments', withhold=True) as named_cr:
+            named_cr.itersize = self.fetch_size
+            named_cr.execute(
+                self.orphan_attachments_query('a.id', table) + sql.SQL(' AND a.id > %s ORDER BY a.id'),
+                [res_model, after_id]
+            )
+            batch = []
+            for attachment_id, in named_cr:
+                batch.append(attachment_id)
+                if len(batch) == self.batch_size:
+                    yield tuple(batch)
+                    batch = []
+            if batch:
+                yield tuple(batch)
+    
+    def estimate_impact(self, res_models):
+        """
+        Dry run: per model, the orphans and their file size are aggregated on the server and the
+        fix statement is only EXPLAINed, nothing is modified and no id is sent to Python.
+        Pages touched are estimated from the catalog: k random rows out of n pages hit about
+        n * (1 - (1 - 1/n)^k) distinct pages.
+        """
+        env.cr.execute(
+            """
+            SELECT c.relpages, c.reltuples, current_setting('block_size')::int,
+                (SELECT count(*) FROM pg_index i WHERE i.indrelid = c.oid)
+            FROM pg_class c
+            WHERE c.oid = 'ir_attachment'::regclass
+            """
+        )
+        relpages, reltuples, block_size, index_count = env.cr.fetchone()
+        estimates = []
+        for res_model in res_models:
             table = res_model.replace('.', '_')
-            related_attachments = [attachment[1] for attachment in list(attachments)]
-            env.cr.execute(sql.SQL(
-                """
-                SELECT id
-                    FROM {}
-                WHERE id IN %s               
-                """
-            ).format(
-                sql.Identifier(table)
-            ), [tuple(related_attachments)])
-            
-            results = env.cr.fetchall()
-            found_records = set([r_id for r_id, in results])
-            
-            missing_attachments = set(related_attachments) - found_records
-            if missing_attachments:
-                records_to_delete[table] = tuple(missing_attachments)
-        return records_to_delete
+            env.cr.execute(
+                self.orphan_attachments_query('count(*), coalesce(sum(a.file_size), 0)', table),
+                [res_model]
+            )
+            orphan_count, file_size = env.cr.fetchone()
+            if not orphan_count:
+                continue
+            if self.strategy == 'delete':
+                statement = sql.SQL("DELETE FROM ir_attachment WHERE id IN ({})")
+            else:
+                statement = sql.SQL("UPDATE ir_attachment SET res_model = NULL, res_id = NULL, res_field = NULL WHERE id IN ({})")
+            env.cr.execute(
+                sql.SQL("EXPLAIN (FORMAT JSON) ") + statement.format(self.orphan_attachments_query('a.id', table)),
+                [res_model]
+            )
+            plan = env.cr.fetchone()[0][0]['Plan']
+            # The ModifyTable node estimates 0 rows on recent versions, its input has the real estimate
+            estimated_rows = int((plan.get('Plans') or [plan])[0]['Plan Rows'])
+            estimated_pages = round(relpages * (1 - (1 - 1 / relpages) ** estimated_rows)) if relpages else 0
+            estimates.append({
+                'table': table,
+                'orphans': orphan_count,
+                'file_size': file_size,
+                'estimated_rows': estimated_rows,
+                'estimated_pages': estimated_pages,
+                'plan_cost': plan['Total Cost'],
+            })
+        
+        print('#############################')
+        print('#######   DRY RUN    ########')
+        print('#############################')
+        print(f"***** STRATEGY - {self.strategy} *****")
+        print(f"ir_attachment: {relpages} pages, ~{int(reltuples)} rows, {index_count} indexes")
+        for estimate in estimates:
+            print(
+                f"- TABLE {estimate['table']}: {estimate['orphans']} orphans, "
+                f"{estimate['file_size'] / (1024 * 1024):.2f} MB of files, "
+                f"~{estimate['estimated_rows']} rows / ~{estimate['estimated_pages']} pages "
+                f"({estimate['estimated_pages'] * block_size / (1024 * 1024):.2f} MB) touched, "
+                f"cost {estimate['plan_cost']}"
+            )
+        total_pages = sum(estimate['estimated_pages'] for estimate in estimates)
+        print(
+            f"TOTAL: {sum(estimate['orphans'] for estimate in estimates)} orphans, "
+            f"{sum(estimate['file_size'] for estimate in estimates) / (1024 * 1024):.2f} MB of files, "
+            f"~{total_pages} heap pages ({total_pages * block_size / (1024 * 1024):.2f} MB) "
+            f"+ {index_count} indexes to maintain, in {-(-sum(estimate['orphans'] for estimate in estimates) // self.batch_size)} batches"
+        )
+        return estimates
     
     def execute_wrapper(self, query, vals):
-        def format_sql_value(val):
-            if isinstance(val, tuple):
-                return f"({', '.join(repr(v) for v in val)})"
-            return repr(val)
-
-        if self.generate_sql_and_csv:
-            safe_query = query.replace('%s', '{}')
-            formatted_vals = [format_sql_value(v) for v in vals]
-            self.sql.append(safe_query.format(*formatted_vals))
-        
         env.cr.execute(query, vals)
-        return env.cr.fetchall()
+        results = env.cr.fetchall()
+        if self.generate_sql_and_csv and results:
+            # (id, res_model, res_id) go to the SQL file, packed in array literals loaded into a temp table
+            ids = ','.join(str(row[0]) for row in results)
+            res_models = ','.join(self.array_text(row[2]) for row in results)
+            res_ids = ','.join(str(row[3]) for row in results)
+            self.sql_file.write(
+                f"INSERT INTO {self.sql_temp_table} (id, res_model, res_id) "
+                f"SELECT unnest('{{{ids}}}'::int[]), unnest('{{{res_models}}}'::varchar[]), unnest('{{{res_ids}}}'::int[]) "
+                f"ON CONFLICT DO NOTHING;\n"
+            )
+            self.csv_writer.writerows(results)
+        return results
     
-    def fix_with_strategy(self, table_ids_to_delete):
-        csv_report = []
-        for model, ids in table_ids_to_delete.items():
-            if not ids:
-                continue
-            if self.strategy == 'delete':
-                results = self.execute_wrapper(
+    @staticmethod
+    def array_text(value):
+        """Quoted element of an array literal, itself inside a SQL string literal"""
+        return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"').replace("'", "''")
+    
+    def open_sql_and_csv_files(self, resuming):
+        """
+        Both files are written while the batches run, a resumed run appends to them.
+        """
+        mode = 'a' if resuming else 'w'
+        self.sql_file = open(f"{self.dir}/sql_file.sql", mode, encoding="utf-8")
+        self.csv_file = open(f"{self.dir}/report_attachments.csv", mode, newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        if resuming:
+            return
+        self.sql_file.write(f"CREATE TEMP TABLE IF NOT EXISTS {self.sql_temp_table} (id INTEGER PRIMARY KEY, res_model VARCHAR NOT NULL, res_id INTEGER NOT NULL);\n")
+        header = ['id', 'name', 'res_model', 'res_id']
+        if self.strategy == 'update':
+            header.append('res_field')
+        self.csv_writer.writerow(header)
+    
+    def close_sql_and_csv_files(self):
+        # One set-based statement over all the loaded ids. The SQL file runs on another copy of the
+        # database: only the attachments still linked to the same missing record are touched
+        if self.strategy == 'delete':
+            self.sql_file.write(
+f"""DELETE FROM ir_attachment a
+USING {self.sql_temp_table} o
+WHERE a.id = o.id AND a.res_model = o.res_model AND a.res_id = o.res_id;
+""")
+        elif self.strategy == 'update':
+            self.sql_file.write(
+f"""UPDATE ir_attachment a
+SET res_model = NULL, res_id = NULL, res_field = NULL
+FROM {self.sql_temp_table} o
+WHERE a.id = o.id AND a.res_model = o.res_model AND a.res_id = o.res_id;
+""")
+        self.sql_file.write(f"DROP TABLE IF EXISTS {self.sql_temp_table};\n")
+        for file in (self.sql_file, self.csv_file):
+            file.close()
+            print(f'FILE GENERATED AT: {file.name}')
+    
+    def create_checkpoint_table(self):
+        env.cr.execute(sql.SQL(
+            """
+            CREATE TABLE IF NOT EXISTS {} (
+                res_table VARCHAR PRIMARY KEY,
+                strategy VARCHAR NOT NULL,
+                last_id INTEGER NOT NULL,
+                rows_done INTEGER NOT NULL,
+                batches_done INTEGER NOT NULL,
+                write_date TIMESTAMP NOT NULL DEFAULT now()
+            )
+            """
+        ).format(sql.Identifier(self.checkpoint_table)))
+        env.cr.commit()
+    
+    def get_checkpoint(self, table):
+        env.cr.execute(sql.SQL(
+            """
+            SELECT last_id, rows_done, batches_done
+            FROM {}
+            WHERE res_table = %s AND strategy = %s
+            """
+        ).format(sql.Identifier(self.checkpoint_table)), [table, self.strategy])
+        return env.cr.fetchone() or (0, 0, 0)
+    
+    def save_checkpoint(self, table, last_id, rows_done, batches_done):
+        env.cr.execute(sql.SQL(
+            """
+            INSERT INTO {} (res_table, strategy, last_id, rows_done, batches_done)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (res_table) DO UPDATE
+            SET strategy = EXCLUDED.strategy,
+                last_id = EXCLUDED.last_id,
+                rows_done = EXCLUDED.rows_done,
+                batches_done = EXCLUDED.batches_done,
+                write_date = now()
+            """
+        ).format(sql.Identifier(self.checkpoint_table)), [table, self.strategy, last_id, rows_done, batches_done])
+    
+    def has_checkpoints(self):
+        env.cr.execute(sql.SQL("SELECT 1 FROM {} WHERE strategy = %s LIMIT 1").format(
+            sql.Identifier(self.checkpoint_table)
+        ), [self.strategy])
+        return bool(env.cr.fetchone())
+    
+    def clear_checkpoints(self):
+        env.cr.execute(sql.SQL("DELETE FROM {}").format(sql.Identifier(self.checkpoint_table)))
+        env.cr.commit()
+    
+    def fix_batch(self, ids):
+        if self.strategy == 'delete':
+            return self.execute_wrapper(
 """DELETE FROM ir_attachment
-WHERE res_model = %s AND res_id IN %s
+WHERE id IN %s
 RETURNING id, name, res_model, res_id;""",
-                    [model.replace('_', '.'), ids]
-                )
-            elif self.strategy == 'update':
-                results = self.execute_wrapper(
+                [ids]
+            )
+        elif self.strategy == 'update':
+            return self.execute_wrapper(
 """WITH old_rows AS (
   SELECT id, name, res_model, res_id, res_field
   FROM ir_attachment
-  WHERE res_model = %s AND res_id IN %s
+  WHERE id IN %s
 ),
 updated AS (
   UPDATE ir_attachment
@@ -125,12 +345,90 @@ updated AS (
 SELECT o.id, o.name, o.res_model, o.res_id, o.res_field
 FROM old_rows o
 JOIN updated u ON o.id = u.id;""",
-                    [model.replace('_', '.'), ids]
-                )
-            csv_report.extend(results)
-        return csv_report
+                [ids]
+            )
+        return []
+    
+    def fix_with_strategy(self, orphan_counts):
+        total_rows = 0
+        for res_model in orphan_counts:
+            table = res_model.replace('.', '_')
+            last_id, rows_done, batches_done = self.get_checkpoint(table)
+            if batches_done:
+                print(f"- TABLE {table}: RESUMING AFTER ID {last_id} ({rows_done} rows in {batches_done} batches already done)")
+            # ids come sorted, the ones up to the checkpoint are already done
+            for batch in self.iter_orphan_attachment_ids(res_model, last_id):
+                batch_start = time.perf_counter()
+                results = self.fix_batch(batch)
+                rows_done += len(results)
+                batches_done += 1
+                self.save_checkpoint(table, batch[-1], rows_done, batches_done)
+                env.cr.commit()
+                print(f"- TABLE {table}: BATCH {batches_done} - {len(results)} rows in {time.perf_counter() - batch_start:.3f}s ({rows_done} done)")
+                total_rows += len(results)
+        return total_rows
 
-    def pre_report(self, report):
+    def iter_filestore(self, filestore):
+        """
+        Yield (store_fname, path, size) of every file in the filestore, sorted by store_fname.
+        Only one directory listing is held in memory at a time.
+        """
+        # store_fname is '<first 2 chars of the sha1>/<sha1>'
+        with os.scandir(filestore) as entries:
+            directories = sorted(entry.name for entry in entries if entry.is_dir() and len(entry.name) == 2)
+        for directory in directories:
+            with os.scandir(os.path.join(filestore, directory)) as entries:
+                files = sorted((entry.name, entry.path, entry.stat().st_size) for entry in entries if entry.is_file())
+            for name, path, size in files:
+                yield f"{directory}/{name}", path, size
+    
+    def iter_store_fnames(self):
+        """
+        Yield the store_fname values of ir_attachment sorted like Python sorts strings (collation "C").
+        """
+        with env.cr._cnx.cursor(name='attachment_store_fnames') as named_cr:
+            named_cr.itersize = self.fetch_size
+            named_cr.execute(
+                """
+                SELECT DISTINCT store_fname COLLATE "C"
+                FROM ir_attachment
+                WHERE store_fname IS NOT NULL
+                ORDER BY 1
+                """
+            )
+            for store_fname, in named_cr:
+                yield store_fname
+    
+    def reconcile_filestore_files(self):
+        filestore = config.filestore(env.cr.dbname)
+        if not os.path.isdir(filestore):
+            print(f'NO FILESTORE FOUND AT: {filestore}')
+            return
+        file_dir = f"{self.dir}/orphan_files.csv"
+        orphan_count = 0
+        orphan_size = 0
+        store_fnames = self.iter_store_fnames()
+        store_fname = next(store_fnames, None)
+        with open(file_dir, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['store_fname', 'path', 'size', 'removed'])
+            # merge join of two sorted streams
+            for fname, path, size in self.iter_filestore(filestore):
+                while store_fname is not None and store_fname < fname:
+                    store_fname = next(store_fnames, None)
+                if store_fname == fname:
+                    continue
+                removed = False
+                if self.remove_orphan_files:
+                    os.remove(path)
+                    removed = True
+                writer.writerow([fname, path, size, removed])
+                orphan_count += 1
+                orphan_size += size
+        print(f'FILESTORE: {orphan_count} ORPHAN FILES, {orphan_size / (1024 * 1024):.2f} MB {"REMOVED" if self.remove_orphan_files else "TO RECLAIM"}')
+        print(f'ORPHAN FILES CSV GENERATED AT: {file_dir}')
+    
+    def pre_report(self, orphan_counts):
         print('#############################')
         print('#######    REPORT    ########')
         print('#############################')
@@ -138,43 +436,34 @@ JOIN updated u ON o.id = u.id;""",
         print(f"***** STRATEGY - {self.strategy} *****")
 
         print(f'TABLE AND COUNTS OF ROWS THAT WILL BE {self.strategy}')
-        res_str = '\n'.join([f"- TABLE {table}: {len(count)} items!" for table, count in report.items()])
+        res_str = '\n'.join([f"- TABLE {res_model.replace('.', '_')}: {count} items!" for res_model, count in orphan_counts.items()])
         print(res_str)
     
-    def create_sql_file(self):
-        if not len(self.sql):
-            print('NO SQL GENERATED')
+    def run(self):
+        if self.reconcile_only:
+            self.reconcile_filestore_files()
             return
-        file_dir = f"{self.dir}/sql_file.sql"
-        with open(file_dir, "w", encoding="utf-8") as f:
-            f.write('\n\n'.join(self.sql))
-        print(f'SQL FILE GENERATED AT: {file_dir}')
-        
-    def create_csv_file(self, report):
-        if not len(report):
-            print('NO REPORT CSV GENERATED')
+        if self.dry_run:
+            self.estimate_impact(self.search_attachments())
+            env.cr.rollback()
             return
-        file_dir = f"{self.dir}/report_attachments.csv"
-        header = ['id', 'name', 'res_model', 'res_id']
-        if self.strategy == 'update':
-            header.append('res_field')
-        report.insert(0, tuple(header))
-        with open(file_dir, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerows(report)
-        print(f'CSV FILE GENERATED AT: {file_dir}')
-
-        
-    def run(self):
-        attachments = self.search_attachments()
-        table_ids_to_delete = self.get_attachments_with_phantom_records(attachments)
+        self.create_checkpoint_table()
+        res_models = self.search_attachments()
+        orphan_counts = self.get_attachments_with_phantom_records(res_models)
         if self.print_data:
-            self.pre_report(table_ids_to_delete)
-        csv_report = self.fix_with_strategy(table_ids_to_delete)
+            self.pre_report(orphan_counts)
         if self.generate_sql_and_csv:
-            self.create_sql_file()
-            self.create_csv_file(csv_report)
-        env.cr.commit()
+            self.open_sql_and_csv_files(self.has_checkpoints())
+        total_rows = self.fix_with_strategy(orphan_counts)
+        print(f'TOTAL ROWS {self.strategy}: {total_rows}')
+        if self.generate_sql_and_csv:
+            self.close_sql_and_csv_files()
+        # Everything is done, the next run starts from scratch
+        self.clear_checkpoints()
+        if self.reconcile_filestore:
+            self.reconcile_filestore_files()
     
+# Only list the orphan files of the filestore, nothing is modified:
+# fix = FixOrphanAttachments(reconcile_only=True)
 fix = FixOrphanAttachments(True)
 fix.run()
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+Synthetic Odoo log generator.
+
+Writes a realistic multi-database Odoo server log (werkzeug requests, cron
+and mail INFO lines, warnings, SQL errors and multi-line tracebacks) to
+benchmark filter_log_databases.py without real customer logs.
+
+Timestamps always increase, as in a real log, so time based filters work.
+"""
+
+import sys
+import random
+import argparse
+from datetime import datetime, timedelta
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# Lines are written by batches of this size
+WRITE_BATCH_SIZE = 4 * 1024 * 1024
+
+ROUTES = [
+    '/web/dataset/call_kw/sale.order/web_read',
+    '/web/dataset/call_kw/account.move/action_post',
+    '/web/dataset/call_kw/res.partner/web_search_read',
+    '/mail/data',
+    '/web/webclient/load_menus',
+    '/longpolling/poll',
+    '/web/image/product.template/42/image_128',
+]
+INFO_LOGGERS = [
+    ('odoo.addons.base.models.ir_cron', 'Job `Mail: Email Queue Manager` ({id}) done.'),
+    ('odoo.addons.mail.models.mail_mail', 'Mail with ID {id} and Message-Id <{id}.odoo@example.com> successfully sent'),
+    ('odoo.modules.registry', 'Registry loaded in {ms}.{id}s'),
+]
+WARNING_LOGGERS = [
+    ('odoo.sql_db', 'bad query: UPDATE res_partner SET write_date=now() WHERE id = {id}'),
+    ('odoo.models', 'account.move.line.read() with unknown field \'x_studio_{id}\''),
+]
+TRACEBACKS = [
+    (
+        [
+            ('/odoo/odoo/http.py', 'dispatch'),
+            ('/odoo/odoo/api.py', 'call_kw'),
+            ('/odoo/addons/account/models/account_move.py', 'action_post'),
+            ('/odoo/addons/account/models/account_move.py', '_post'),
+        ],
+        'odoo.exceptions.UserError: The move account.move({id},) is not balanced.',
+    ),
+    (
+        [
+            ('/odoo/odoo/service/model.py', 'retrying'),
+            ('/odoo/odoo/sql_db.py', 'execute'),
+        ],
+        'psycopg2.errors.SerializationFailure: could not serialize access due to concurrent update',
+    ),
+    (
+        [
+            ('/odoo/odoo/http.py', 'dispatch'),
+            ('/odoo/odoo/models.py', 'write'),
+            ('/odoo/odoo/fields.py', '__set__'),
+        ],
+        "ValueError: Wrong value for res.partner.email: 'user{id}@example'",
+    ),
+]
+
+
+def parse_size(value):
+    """
+    Parse a size like 512K, 200M or 10G.
+    """
+    value = value.strip().upper().rstrip('B')
+    unit = SIZE_UNITS.get(value[-1:], 1)
+    number = value[:-1] if value[-1:] in SIZE_UNITS else value
+    try:
+        return int(float(number) * unit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: '{value}'")
+
+
+def generate_entries(databases, traceback_ratio, rng, start=None):
+    """
+    Yield log entries (one string, traceback lines included) forever.
+    """
+    moment = start or datetime(2024, 5, 1)
+    pids = [rng.randint(1000, 99999) for _ in range(8)]
+
+    while True:
+        moment += timedelta(microseconds=rng.randint(0, 20000))
+        timestamp = f"{moment:%Y-%m-%d %H:%M:%S},{moment.microsecond // 1000:03d}"
+        pid = rng.choice(pids)
+        db_name = rng.choice(databases)
+        record_id = rng.randint(1, 5000000)
+
+        if rng.random() < traceback_ratio:
+            frames, exception = rng.choice(TRACEBACKS)
+            lines = [
+                f"{timestamp} {pid} ERROR {db_name} odoo.http: Exception during request handling.",
+                'Traceback (most recent call last):',
+            ]
+            for path, function in frames:
+                lines.append(f'  File "{path}", line {rng.randint(10, 5000)}, in {function}')
+                lines.append('    return self._call(*args, **kwargs)')
+            lines.append(exception.format(id=record_id))
+            yield '\n'.join(lines) + '\n'
+            continue
+
+        roll = rng.random()
+        if roll < 0.7:
+            yield (
+                f"{timestamp} {pid} INFO {db_name} werkzeug: 10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)} - - "
+                f"[{moment:%d/%b/%Y %H:%M:%S}] \"POST {rng.choice(ROUTES)} HTTP/1.1\" 200 - "
+                f"{rng.randint(1, 90)} {rng.random():.3f} {rng.random():.3f}\n"
+            )
+        elif roll < 0.95:
+            logger, message = rng.choice(INFO_LOGGERS)
+            message = message.format(id=record_id, ms=rng.randint(0, 9))
+            yield f"{timestamp} {pid} INFO {db_name} {logger}: {message}\n"
+        else:
+            logger, message = rng.choice(WARNING_LOGGERS)
+            yield f"{timestamp} {pid} WARNING {db_name} {logger}: {message.format(id=record_id)}\n"
+
+
+def generate_log(output_file, size, databases=40, traceback_ratio=0.01, seed=None):
+    """
+    Write about size bytes of log to output_file.
+    Returns a tuple (bytes_written, entries_written).
+    """
+    rng = random.Random(seed)
+    database_names = [f"db_{i:03d}" for i in range(databases)]
+    bytes_written = 0
+    entries_written = 0
+    batch = []
+    batch_size = 0
+
+    with open(output_file, 'w', encoding='utf-8') as outfile:
+        for entry in generate_entries(database_names, traceback_ratio, rng):
+            batch.append(entry)
+            batch_size += len(entry)
+            entries_written += 1
+
+            if batch_size >= WRITE_BATCH_SIZE or bytes_written + batch_size >= size:
+                outfile.write(''.join(batch))
+                bytes_written += batch_size
+                batch, batch_size = [], 0
+                if bytes_written >= size:
+                    break
+
+    return bytes_written, entries_written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic Odoo log',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s -o bench_1g.log -s 1G
+  %(prog)s -o bench_10g.log -s 10G --databases 60 --traceback-ratio 0.02 --seed 42
+        """
+    )
+
+    parser.add_argument('-o', '--output',
+                        required=True,
+                        help='Output log file path')
+
+    parser.add_argument('-s', '--size',
+                        type=parse_size,
+                        required=True,
+                        help='Approximate size of the log, e.g. 200M, 1G, 10G')
+
+    parser.add_argument('--databases',
+                        type=int,
+                        default=40,
+                        help='Number of databases logging in the same file (default: 40)')
+
+    parser.add_argument('--traceback-ratio',
+                        type=float,
+                        default=0.01,
+                        help='Share of entries that are error tracebacks (default: 0.01)')
+
+    parser.add_argument('--seed',
+                        type=int,
+                        help='Random seed, to get the same log twice')
+
+    args = parser.parse_args()
+
+    print(f"Generating {args.size} bytes of log in: {args.output}")
+    bytes_written, entries_written = generate_log(
+        args.output, args.size, args.databases, args.traceback_ratio, args.seed,
+    )
+    print(f"\nSuccess! Wrote {entries_written} entries ({bytes_written} bytes).")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\nProcess cancelled by user.")
+        sys.exit(0)
@@ -9,12 +9,24 @@ YOU MUST NEED A BACKUP.
 x_plan2_id must be replaced to the old field that had the content of the ids.
 account_id is the target.
 
+When both databases are reachable from the same machine, restore_columns_from_backup.py applies
+the fix directly, without generating code:
+    restore_columns_from_backup.py --backup db-backup --target db-with-issue -t account_analytic_line
+        --map x_plan2_id:account_id --where "account_id IS NULL" --source-where "x_plan2_id IS NOT NULL"
+
 OPW-5359529
 """
 
+import base64
+
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+# Characters of base64 payload per line of the generated code
+PAYLOAD_LINE_LENGTH = 4096
+# Rows inserted in the temp table per query by the scheduled action
+INSERT_BATCH_SIZE = 100000
+
 # Database connection configuration
 BACKUP_DB = {
     'dbname': 'db-backup',
@@ -71,26 +83,75 @@ def get_migration_data():
     
     return correct_data
 
+def zigzag(number):
+    """Signed to unsigned, small negatives stay small: 0, -1, 1, -2... -> 0, 1, 2, 3..."""
+    return number * 2 if number >= 0 else -number * 2 - 1
+
+
+def encode_changes(data):
+    """
+    Encode the rows {id, x_plan2_id} as base64 of varints: for every row sorted by id,
+    the delta with the previous id and the delta with the previous account, zigzag encoded.
+    Close ids and repeated accounts take 1 byte each, instead of ~15 characters per row.
+    """
+    payload = bytearray()
+    previous_id = previous_account_id = 0
+    for row in sorted(data, key=lambda row: row['id']):
+        for number in (row['id'] - previous_id, row['x_plan2_id'] - previous_account_id):
+            number = zigzag(number)
+            while number > 0x7F:
+                payload.append(number & 0x7F | 0x80)
+                number >>= 7
+            payload.append(number)
+        previous_id, previous_account_id = row['id'], row['x_plan2_id']
+    return base64.b64encode(bytes(payload)).decode('ascii')
+
+
 def generate_odoo_scheduled_action_code(data):
     """
-    Generates Python code for an Odoo Scheduled Action
+    Generates Python code for an Odoo Scheduled Action.
+    zlib can't be imported in a scheduled action, so the payload is only delta + varint
+    encoded, and decoded with b64decode of the action context.
     """
+    payload = encode_changes(data)
     lines = []
     lines.append("# Copy this code into an Odoo Scheduled Action")
     lines.append("")
-    lines.append("# Changes dictionary: {id: correct_account_id}")
-    lines.append("CHANGES = {")
-    
-    # Add data to dictionary
-    for i, row in enumerate(data):
-        comma = "," if i < len(data) - 1 else ""
-        lines.append(f"    {row['id']}: {row['x_plan2_id']}{comma}")
-    
-    lines.append("}")
+    lines.append("# Changes {id: correct_account_id}, see encode_changes() in migrate_analytic_lines_from_backup.py")
+    lines.append(f"COUNT = {len(data)}")
+    lines.append("PAYLOAD = (")
+    # Always a string, even without any change
+    lines.append("    ''")
+    for i in range(0, len(payload), PAYLOAD_LINE_LENGTH):
+        lines.append(f"    '{payload[i:i + PAYLOAD_LINE_LENGTH]}'")
+    lines.append(")")
+    lines.append("")
+    lines.append("def decode_changes():")
+    lines.append("    ids, account_ids = [], []")
+    lines.append("    record_id = account_id = 0")
+    lines.append("    deltas = []")
+    lines.append("    number = shift = 0")
+    lines.append("    for byte in b64decode(PAYLOAD):")
+    lines.append("        number |= (byte & 0x7F) << shift")
+    lines.append("        if byte & 0x80:")
+    lines.append("            shift += 7")
+    lines.append("            continue")
+    lines.append("        deltas.append(number >> 1 if not number & 1 else -((number + 1) >> 1))")
+    lines.append("        number = shift = 0")
+    lines.append("        if len(deltas) == 2:")
+    lines.append("            record_id += deltas[0]")
+    lines.append("            account_id += deltas[1]")
+    lines.append("            ids.append(record_id)")
+    lines.append("            account_ids.append(account_id)")
+    lines.append("            deltas = []")
+    lines.append("    return ids, account_ids")
     lines.append("")
     lines.append("def apply_changes():")
     lines.append("    try:")
-    lines.append("        _logger.info(f'Applying {len(CHANGES)} changes...')")
+    lines.append("        ids, account_ids = decode_changes()")
+    lines.append("        if len(ids) != COUNT:")
+    lines.append("            raise UserError(f'Decoded {len(ids)} changes instead of {COUNT}')")
+    lines.append("        _logger.info(f'Applying {len(ids)} changes...')")
     lines.append("        ")
     lines.append("        # Create temporary table")
     lines.append("        env.cr.execute('''")
@@ -100,18 +161,13 @@ def generate_odoo_scheduled_action_code(data):
     lines.append("            )")
     lines.append("        ''')")
     lines.append("        ")
-    lines.append("        # Insert changes in batches")
-    lines.append("        batch_size = 1000")
-    lines.append("        items = list(CHANGES.items())")
-    lines.append("        ")
-    lines.append("        for i in range(0, len(items), batch_size):")
-    lines.append("            batch = items[i:i + batch_size]")
-    lines.append("            values = ','.join([f'({record_id},{account_id})' for record_id, account_id in batch])")
-    lines.append("            ")
-    lines.append("            env.cr.execute(f'''")
+    lines.append("        # Insert changes in batches, two arrays per query")
+    lines.append(f"        batch_size = {INSERT_BATCH_SIZE}")
+    lines.append("        for i in range(0, len(ids), batch_size):")
+    lines.append("            env.cr.execute('''")
     lines.append("                INSERT INTO temp_account_fixes (id, account_id)")
-    lines.append("                VALUES {values}")
-    lines.append("            ''')")
+    lines.append("                SELECT unnest(%s::int[]), unnest(%s::int[])")
+    lines.append("            ''', [ids[i:i + batch_size], account_ids[i:i + batch_size]])")
     lines.append("        ")
     lines.append("        # Single UPDATE using JOIN with temp table")
     lines.append("        env.cr.execute('''")
@@ -149,7 +205,7 @@ def main():
     with open(odoo_file, 'w', encoding='utf-8') as f:
         f.write(odoo_code)
     
-    print(f"✓ Code for Odoo generated: {odoo_file}")
+    print(f"✓ Code for Odoo generated: {odoo_file} ({len(odoo_code) / 1024:.1f} KB)")
     print(f"\n{'='*60}")
     print(f"Total changes: {len(data)}")
     print(f"{'='*60}")
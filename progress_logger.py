@@ -0,0 +1,129 @@
+"""
+Progress and logging helper shared by the scripts of this repo.
+
+Long fixes used to keep every message in a list, join it into a single ir.logging record at the
+end and print a progress bar for every processed record. ProgressLogger instead:
+- prints/logs the progress bar at most once every progress_interval seconds,
+- streams the full detail (one line per record) to a file, flushed as it goes,
+- sends the summary messages to a sink (e.g. ir.logging) in chunks of bounded size.
+
+Memory stays bounded whatever the number of processed records.
+
+Scripts run in an odoo shell need this directory in sys.path:
+    import sys
+    sys.path.insert(0, '<path to odoo_useful_scripts>')
+    from progress_logger import ProgressLogger, ir_logging_sink
+"""
+
+import time
+
+
+def progress_bar(current, total, bar_length=50):
+    """Generate a progress bar string"""
+    progress = float(current) / float(total) if total else 1.0
+    arrow = '█' * int(round(progress * bar_length))
+    spaces = '░' * (bar_length - len(arrow))
+    percent = round(progress * 100, 2)
+    return f'[{arrow}{spaces}] {percent}% ({current}/{total})'
+
+
+def ir_logging_sink(env, name):
+    """
+    Sink writing every summary chunk as an ir.logging record, they are committed with the
+    script transaction.
+    """
+    def sink(message, chunk):
+        env['ir.logging'].create({
+            'name': name if chunk == 1 else f'{name} ({chunk})',
+            'type': 'server',
+            'level': 'INFO',
+            'dbname': env.cr.dbname,
+            'message': message,
+            'func': '',
+            'path': '',
+            'line': '',
+        })
+    return sink
+
+
+class ProgressLogger:
+    """
+    - log(): summary message, goes to the logger (or stdout), the detail file and the sink.
+    - detail(): per record message, only goes to the detail file.
+    - progress(): rate limited progress bar.
+    Call close() (or use it as a context manager) to flush the last summary chunk.
+    """
+
+    def __init__(self, total=0, logger=None, detail_file=None, summary_sink=None,
+                 progress_interval=5.0, summary_chunk_size=64 * 1024, summary_interval=60.0):
+        self.total = total
+        self.logger = logger
+        self.detail_file = open(detail_file, 'a', encoding='utf-8') if detail_file else None
+        self.summary_sink = summary_sink
+        self.progress_interval = progress_interval
+        self.summary_chunk_size = summary_chunk_size
+        self.summary_interval = summary_interval
+        self.summary = []
+        self.summary_size = 0
+        self.summary_chunks = 0
+        self.last_progress = None
+        self.last_summary = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_detail(self, msg):
+        if self.detail_file:
+            self.detail_file.write(msg + '\n')
+
+    def log(self, msg, header=False):
+        msg = msg if not header else f"\n{header*10}\n{msg}\n{header*10}\n"
+        if self.logger:
+            self.logger.info(msg)
+        else:
+            print(msg)
+        self._write_detail(msg)
+        if self.summary_sink:
+            self.summary.append(msg)
+            self.summary_size += len(msg) + 1
+            if (self.summary_size >= self.summary_chunk_size
+                    or time.monotonic() - self.last_summary >= self.summary_interval):
+                self.flush()
+
+    def detail(self, msg):
+        if self.detail_file:
+            self._write_detail(msg)
+        elif self.logger:
+            self.logger.debug(msg)
+
+    def progress(self, current, total=None, msg=''):
+        """
+        Log the progress bar if progress_interval seconds went by since the last one,
+        the last step is always logged.
+        """
+        total = total if total is not None else self.total
+        now = time.monotonic()
+        if (current < total and self.last_progress is not None
+                and now - self.last_progress < self.progress_interval):
+            return
+        self.last_progress = now
+        self.log(f"{progress_bar(current, total)} {msg}".rstrip())
+
+    def flush(self):
+        if self.detail_file:
+            self.detail_file.flush()
+        if self.summary_sink and self.summary:
+            self.summary_chunks += 1
+            self.summary_sink('\n'.join(self.summary), self.summary_chunks)
+            self.summary = []
+            self.summary_size = 0
+        self.last_summary = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self.detail_file:
+            self.detail_file.close()
+            self.detail_file = None
@@ -0,0 +1,225 @@
+"""
+RESTORE COLUMNS FROM BACKUP
+
+Copies the values of some columns of a table from a backup database to the live one, matching
+the rows by a key column. Generic version of migrate_analytic_lines_from_backup.py, usable when
+both databases are reachable from the same machine.
+
+- the backup rows are streamed with a server-side cursor, chunk by chunk,
+- every chunk is COPYed into a temp table of the target database,
+- a single UPDATE ... FROM applies them, only on the rows matching --where and only when a
+  value differs, in one transaction (nothing is changed if anything fails).
+
+Memory stays bounded by --chunk-size, so it holds up on tens of millions of rows.
+
+Values are read as text and parsed back with the types of the target columns, so a source
+column can be restored into a target column with another name (e.g. x_plan2_id -> account_id).
+
+YOU MUST NEED A BACKUP.
+"""
+
+import io
+import sys
+import argparse
+
+import psycopg2
+from psycopg2 import sql
+
+from progress_logger import ProgressLogger
+
+# Rows fetched from the backup and COPYed to the target at once
+CHUNK_SIZE = 100000
+# Text format of COPY: backslash, tab and newlines must be escaped, NULL is \N
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def parse_mapping(value):
+    """
+    Parse a --map value: 'source:target', or 'column' when the name is the same on both sides.
+    """
+    source, _sep, target = value.partition(':')
+    if not source:
+        raise argparse.ArgumentTypeError(f"invalid mapping: '{value}'")
+    return source, target or source
+
+
+def connect(dbname, args):
+    return psycopg2.connect(dbname=dbname, user=args.user, host=args.host, port=args.port)
+
+
+def get_column_types(cr, table, columns):
+    """
+    Returns {column: SQL type} of the given columns of table, raises if one is missing.
+    """
+    cr.execute("""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass
+          AND attname = ANY(%s)
+          AND attnum > 0
+          AND NOT attisdropped
+    """, (table, list(columns)))
+    types = dict(cr.fetchall())
+    missing = [column for column in columns if column not in types]
+    if missing:
+        raise ValueError(f"Columns not found in {table}: {', '.join(missing)}")
+    return types
+
+
+def estimate_rows(cr, table):
+    cr.execute("SELECT greatest(reltuples, 0)::bigint FROM pg_class WHERE oid = %s::regclass", (table,))
+    return cr.fetchone()[0]
+
+
+def copy_value(value):
+    return '\\N' if value is None else value.translate(COPY_ESCAPES)
+
+
+def restore_columns(conn_backup, conn_target, table, key, mapping, where=None, source_where=None,
+                    chunk_size=CHUNK_SIZE, dry_run=False):
+    """
+    Copy the backup values of mapping [(source, target)] into the target rows of table with
+    the same key. where filters the target rows, source_where the backup rows (raw SQL).
+    Returns a tuple (rows_copied, rows_updated).
+    """
+    cr_target = conn_target.cursor()
+    targets = [target for _source, target in mapping]
+    types = get_column_types(cr_target, table, [key, *targets])
+
+    # Temp columns are named _key, _c0, _c1... so --where can't be ambiguous
+    temp_columns = ['_c%d' % i for i in range(len(mapping))]
+    cr_target.execute(sql.SQL("CREATE TEMP TABLE restore_rows ({}) ON COMMIT DROP").format(
+        sql.SQL(', ').join(
+            sql.SQL('{} {}').format(sql.Identifier(name), sql.SQL(types[column]))
+            for name, column in zip(['_key', *temp_columns], [key, *targets])
+        )
+    ))
+
+    # Cast to text in the backup, parsed back by COPY with the target types
+    query = sql.SQL("SELECT {} FROM {}{}").format(
+        sql.SQL(', ').join(
+            sql.SQL('{}::text').format(sql.Identifier(column))
+            for column in [key, *(source for source, _target in mapping)]
+        ),
+        sql.Identifier(table),
+        sql.SQL(' WHERE ({})').format(sql.SQL(source_where)) if source_where else sql.SQL(''),
+    )
+    cr_backup = conn_backup.cursor(name='restore_columns_from_backup')
+    cr_backup.itersize = chunk_size
+    cr_backup.execute(query)
+
+    progress = ProgressLogger(estimate_rows(cr_target, table))
+    copied = 0
+    while True:
+        rows = cr_backup.fetchmany(chunk_size)
+        if not rows:
+            break
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        cr_target.copy_expert("COPY restore_rows FROM STDIN", buffer)
+        copied += len(rows)
+        progress.progress(copied, max(progress.total, copied), '- rows copied')
+    cr_backup.close()
+    progress.progress(copied, copied, '- rows copied')
+
+    cr_target.execute("ANALYZE restore_rows")
+    assignments = [
+        sql.SQL('{} = s.{}').format(sql.Identifier(target), sql.Identifier(temp))
+        for target, temp in zip(targets, temp_columns)
+    ]
+    # Only the rows whose values differ are rewritten
+    cr_target.execute(sql.SQL("""
+        UPDATE {table} AS t
+        SET {assignments}
+        FROM restore_rows AS s
+        WHERE t.{key} = s._key
+          AND ({current}) IS DISTINCT FROM ({restored})
+          {where}
+    """).format(
+        table=sql.Identifier(table),
+        assignments=sql.SQL(', ').join(assignments),
+        key=sql.Identifier(key),
+        current=sql.SQL(', ').join(sql.SQL('t.{}').format(sql.Identifier(target)) for target in targets),
+        restored=sql.SQL(', ').join(sql.SQL('s.{}').format(sql.Identifier(temp)) for temp in temp_columns),
+        where=sql.SQL('AND ({})').format(sql.SQL(where)) if where else sql.SQL(''),
+    ))
+    updated = cr_target.rowcount
+
+    if dry_run:
+        conn_target.rollback()
+    else:
+        conn_target.commit()
+    cr_target.close()
+    return copied, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Restore columns of a table from a backup database',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s --backup db-backup --target db-with-issue -t account_analytic_line \\
+      --map x_plan2_id:account_id --where "account_id IS NULL" --source-where "x_plan2_id IS NOT NULL"
+  %(prog)s --backup db-backup --target db-live -t res_partner --map email --map phone --dry-run
+        """
+    )
+
+    parser.add_argument('--backup', required=True, help='Backup database name')
+    parser.add_argument('--target', required=True, help='Database to restore the values into')
+    parser.add_argument('-t', '--table', required=True, help='Table to restore')
+    parser.add_argument('-k', '--key', default='id', help='Column matching the rows (default: id)')
+    parser.add_argument('-m', '--map',
+                        dest='mapping',
+                        action='append',
+                        type=parse_mapping,
+                        required=True,
+                        metavar='SOURCE[:TARGET]',
+                        help='Backup column to restore into the target column, can be repeated')
+    parser.add_argument('-w', '--where',
+                        help='SQL filter of the target rows to update, e.g. "account_id IS NULL"')
+    parser.add_argument('--source-where',
+                        help='SQL filter of the backup rows to read, e.g. "x_plan2_id IS NOT NULL"')
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=CHUNK_SIZE,
+                        help=f'Rows fetched and COPYed at once (default: {CHUNK_SIZE})')
+    parser.add_argument('--dry-run',
+                        action='store_true',
+                        help='Count the rows that would be updated, change nothing')
+    parser.add_argument('--user', help='Database user (default: libpq defaults)')
+    parser.add_argument('--host', help='Database host (default: libpq defaults)')
+    parser.add_argument('--port', help='Database port (default: libpq defaults)')
+
+    args = parser.parse_args()
+
+    print(f"Connecting to {args.backup} and {args.target}...")
+    conn_backup = connect(args.backup, args)
+    conn_backup.set_session(readonly=True)
+    conn_target = connect(args.target, args)
+    try:
+        copied, updated = restore_columns(
+            conn_backup, conn_target, args.table, args.key, args.mapping,
+            args.where, args.source_where, args.chunk_size, args.dry_run,
+        )
+    finally:
+        conn_backup.close()
+        conn_target.close()
+
+    columns = ', '.join(f"{source} -> {target}" for source, target in args.mapping)
+    print(f"\n{'='*60}")
+    print(f"Table: {args.table} ({columns})")
+    print(f"Rows read from the backup: {copied}")
+    print(f"Rows {'to update' if args.dry_run else 'updated'}: {updated}")
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\nProcess cancelled by user.")
+        sys.exit(0)
@@ -0,0 +1,66 @@
+"""
+filter_logs_parallel() must write byte for byte what filter_logs_by_database() writes,
+whatever the number of chunks and processes.
+
+    python -m pytest test_filter_log_databases.py
+"""
+
+import pytest
+
+import filter_log_databases as fld
+from generate_odoo_log import generate_log
+
+SPECIAL_LINES = [
+    # CRLF line endings
+    b'2024-05-01 10:00:00,001 11 INFO db_a odoo.modules: crlf entry\r\n',
+    b'Traceback (most recent call last):\r\n',
+    b'ValueError: crlf traceback\r\n',
+    # Lone CR inside an entry and as a line ending
+    b'2024-05-01 10:00:00,002 12 INFO db_b odoo.http: lone\rcr entry\n',
+    b'2024-05-01 10:00:00,003 12 INFO db_a odoo.http: lone cr ending\r',
+    b'continuation after a lone cr\n',
+    # Invalid UTF-8
+    b'2024-05-01 10:00:00,004 13 WARNING db_a odoo.models: invalid \xff\xfe utf-8\n',
+    b'  File "/odoo/\xc3(bad.py", line 1, in <module>\n',
+    b'2024-05-01 10:00:00,005 13 ERROR db_b odoo.sql_db: bad query \xe9\n',
+]
+
+
+def assert_same_output(input_file, tmp_path, jobs, chunk_size):
+    serial = tmp_path / 'serial.log'
+    parallel = tmp_path / 'parallel.log'
+    for database in ('db_a', 'db_b', 'db_000', 'missing'):
+        expected = fld.filter_logs_by_database(str(input_file), str(serial), database)
+        result = fld.filter_logs_parallel(str(input_file), str(parallel), database, jobs, chunk_size)
+        assert result == expected
+        assert parallel.read_bytes() == serial.read_bytes()
+
+
+@pytest.fixture
+def generated_log(tmp_path):
+    input_file = tmp_path / 'generated.log'
+    generate_log(str(input_file), 256 * 1024, databases=4, traceback_ratio=0.05, seed=42)
+    # Special lines spread at the start, the middle and the end of the log
+    data = input_file.read_bytes()
+    middle = data.index(b'\n', len(data) // 2) + 1
+    special = b''.join(SPECIAL_LINES)
+    input_file.write_bytes(special + data[:middle] + special + data[middle:] + special)
+    return input_file
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 3, 8])
+@pytest.mark.parametrize('chunk_size', [97, 4096, 64 * 1024, fld.CHUNK_SIZE])
+def test_parallel_matches_serial(generated_log, tmp_path, jobs, chunk_size):
+    assert_same_output(generated_log, tmp_path, jobs, chunk_size)
+
+
+@pytest.mark.parametrize('content', [
+    b'',
+    b'ab\n',
+    b'\xff\r\n',
+    SPECIAL_LINES[0],
+])
+def test_file_smaller_than_jobs(tmp_path, content):
+    input_file = tmp_path / 'tiny.log'
+    input_file.write_bytes(content)
+    assert_same_output(input_file, tmp_path, 8, fld.CHUNK_SIZE)
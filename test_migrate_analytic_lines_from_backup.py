@@ -0,0 +1,61 @@
+"""
+The scheduled action generated by migrate_analytic_lines_from_backup.py must insert exactly
+the rows it was generated from.
+
+    python -m pytest test_migrate_analytic_lines_from_backup.py
+"""
+
+import base64
+import random
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from migrate_analytic_lines_from_backup import generate_odoo_scheduled_action_code
+
+
+class FakeCursor:
+    """Keeps the (ids, account_ids) inserted in the temp table"""
+
+    def __init__(self):
+        self.inserted = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        if params:
+            self.inserted.extend(zip(*params))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def run_action(data):
+    cr = FakeCursor()
+    context = {
+        'env': SimpleNamespace(cr=cr),
+        'b64decode': base64.b64decode,
+        '_logger': SimpleNamespace(info=lambda message: None),
+        'UserError': Exception,
+    }
+    exec(generate_odoo_scheduled_action_code(data), context)
+    return cr.inserted
+
+
+@pytest.mark.parametrize('data', [
+    [],
+    [{'id': 1, 'x_plan2_id': 0}],
+    # Unsorted ids, decreasing accounts, multi-byte varints
+    [{'id': 10 ** 9, 'x_plan2_id': 3}, {'id': 7, 'x_plan2_id': 2 ** 31 - 1}, {'id': 8, 'x_plan2_id': 1}],
+    [
+        {'id': record_id, 'x_plan2_id': random.Random(record_id).choice([3, 7, 120, 5000, 70000])}
+        for record_id in range(1, 250000, 2)
+    ],
+])
+def test_round_trip(data):
+    expected = sorted((row['id'], row['x_plan2_id']) for row in data)
+    assert run_action(data) == expected